@@ -3,62 +3,83 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from loguru import logger
 
 from app.database import get_db
 from app.models import Sensor as SensorModel
-from app.schemas import SensorCreate, Sensor as SensorOut
+from app.schemas import SENSOR_LIST_ADAPTER, SensorCreate, Sensor as SensorOut
 
 router = APIRouter(prefix="/sensors", tags=["sensors"])
 
 
 @router.post("/", response_model=SensorOut, status_code=status.HTTP_201_CREATED)
-def create_sensor(payload: SensorCreate, db: Session = Depends(get_db)) -> SensorOut:
+async def create_sensor(payload: SensorCreate, db: AsyncSession = Depends(get_db)) -> Response:
     """Create a new sensor with a unique name."""
+    # A new sensor has no metrics; initializing the collection avoids a lazy load
+    # (not allowed under asyncio) when the response is serialized.
+    sensor = SensorModel(name=payload.name, metrics=[])
     try:
-        existing = db.query(SensorModel).filter(SensorModel.name == payload.name).first()
-        if existing:
-            logger.warning(f"Sensor creation failed: name '{payload.name}' already exists")
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"Sensor with name '{payload.name}' already exists.",
-            )
-        
-        sensor = SensorModel(name=payload.name)
         db.add(sensor)
-        db.commit()
-        db.refresh(sensor)
-        
-        logger.info(f"Sensor created", extra={
-            "sensor_id": sensor.id,
-            "sensor_name": payload.name
-        })
-        
-        return sensor  # FastAPI will serialize via Pydantic schema
-        
-    except HTTPException:
-        # Re-raise HTTP exceptions (already logged above)
-        raise
+        # The UNIQUE constraint on name detects duplicates, race-free and without a pre-SELECT
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        logger.warning(f"Sensor creation failed: name '{payload.name}' already exists")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Sensor with name '{payload.name}' already exists.",
+        )
     except Exception as e:
         logger.error(f"Unexpected error creating sensor: {e}", extra={
             "sensor_name": payload.name
         })
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    logger.info(f"Sensor created", extra={
+        "sensor_id": sensor.id,
+        "sensor_name": payload.name
+    })
+
+    # Returned as a Response so FastAPI skips re-validating it against response_model
+    return Response(
+        content=SensorOut.from_orm_fast(sensor).model_dump_json(),
+        status_code=status.HTTP_201_CREATED,
+        media_type="application/json",
+    )
+
 
 @router.get("/", response_model=list[SensorOut])
-def list_sensors(db: Session = Depends(get_db)) -> list[SensorOut]:
-    """Return all sensors."""
-    return db.query(SensorModel).all()
+async def list_sensors(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of sensors to return"),
+    offset: int = Query(0, ge=0, description="Number of sensors to skip"),
+    db: AsyncSession = Depends(get_db),
+) -> Response:
+    """Return one page of sensors, ordered by id."""
+    # Paging bounds both the sensor rows and the metrics selectin-loaded for them
+    stmt = (
+        select(SensorModel)
+        .order_by(SensorModel.id)
+        .limit(limit)
+        .offset(offset)
+        .options(selectinload(SensorModel.metrics))
+    )
+    sensors = (await db.execute(stmt)).scalars().all()
+    # Constructed without validation and dumped to JSON in one pass by pydantic-core
+    body = SENSOR_LIST_ADAPTER.dump_json([SensorOut.from_orm_fast(s) for s in sensors])
+    return Response(content=body, media_type="application/json")
 
 
 @router.get("/{sensor_id}", response_model=SensorOut)
-def get_sensor(sensor_id: int, db: Session = Depends(get_db)) -> SensorOut:
+async def get_sensor(sensor_id: int, db: AsyncSession = Depends(get_db)) -> Response:
     """Return a single sensor by id."""
-    sensor = db.query(SensorModel).filter(SensorModel.id == sensor_id).first()
+    # Primary-key lookup goes through the session identity map first
+    sensor = await db.get(SensorModel, sensor_id, options=[selectinload(SensorModel.metrics)])
     if not sensor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor not found")
-    return sensor
\ No newline at end of file
+    return Response(content=SensorOut.from_orm_fast(sensor).model_dump_json(), media_type="application/json")
\ No newline at end of file
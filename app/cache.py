@@ -0,0 +1,99 @@
+# app/cache.py
+"""In-process TTL cache for aggregation query results."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional, Sequence
+
+from fastapi import Request
+
+
+def minute_window(start: datetime, end: datetime) -> tuple[datetime, datetime]:
+    """Widen a window to whole minutes (floor start, ceil end) so polling clients share cache keys."""
+    start = start.replace(second=0, microsecond=0)
+    floored_end = end.replace(second=0, microsecond=0)
+    return start, floored_end if floored_end == end else floored_end + timedelta(minutes=1)
+
+
+class QueryCache:
+    """Small TTL cache for aggregation results, cleared whenever metrics are written.
+
+    Entries are kept per process: with several workers, a write is only visible
+    to the other workers once their entries expire (at most ``ttl`` seconds).
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Bumped by clear(); results computed across a clear are never stored
+        self.generation = 0
+        self._entries: dict[str, tuple[float, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(
+        stat: str,
+        sensors: Optional[Sequence[int]],
+        metrics: Optional[Sequence[str]],
+        start: datetime,
+        end: datetime,
+    ) -> str:
+        """Hash normalized query parameters into a compact cache key.
+
+        Callers widen the window (minute_window) before querying and pass that
+        same window here, so cached results always cover exactly what the key says.
+        """
+        params = {
+            "stat": stat,
+            "sensors": sorted(set(sensors)) if sensors else None,
+            "metrics": sorted(set(metrics)) if metrics else None,
+            "start": start,
+            "end": end,
+        }
+        raw = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss or expired entry."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(
+        self, key: str, value: Any, ttl: Optional[float] = None, generation: Optional[int] = None
+    ) -> None:
+        """Store value under key; evicts the oldest entry when full.
+
+        Pass the ``generation`` read before computing value: if the cache was
+        cleared since (a write landed meanwhile), the possibly stale value is dropped.
+        """
+        if not self.enabled or (generation is not None and generation != self.generation):
+            return
+        if len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def clear(self) -> None:
+        """Drop every cached result (called after metric writes)."""
+        self.generation += 1
+        self._entries.clear()
+
+
+def get_query_cache(request: Request) -> QueryCache:
+    """FastAPI dependency returning the application's query cache."""
+    return request.app.state.query_cache
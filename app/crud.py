@@ -1,80 +1,257 @@
 # app/crud.py
 import time
-from sqlalchemy import select, func
-from sqlalchemy.orm import Session
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from sqlalchemy import (
+    Float,
+    SmallInteger,
+    String,
+    bindparam,
+    case,
+    cast,
+    func,
+    literal_column,
+    or_,
+    select,
+    type_coerce,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from loguru import logger
-from app.models import Metric
-from app.enums import MetricType
+from app.models import METRIC_TYPE_CODES, Metric, MetricRollupHourly
+from app.enums import MetricType, Stat
+from app.rollups import ceil_hour, floor_hour, watermark_subquery
 
-def aggregate_metrics(
-    db: Session,
-    stat: str,
-    sensors: Optional[List[int]],
-    metrics: Optional[List[MetricType]],
-    start: Optional[datetime],
-    end: Optional[datetime],
-):
-    """Execute aggregated metrics query with performance monitoring."""
-    start_time = time.time()
-    
+# Queries slower than this are logged at WARNING level
+SLOW_QUERY_THRESHOLD_MS = 500
+
+# Ranges at least this long are answered from hourly rollups where available
+ROLLUP_MIN_RANGE = timedelta(days=1)
+
+SUPPORTED_STATS = frozenset(Stat)
+
+
+def _as_str(metric_type):
+    """Select metric_type as its API string, decoded in SQL rather than per row in Python."""
+    # Inlined constants keep the statement free of bound parameters
+    codes = type_coerce(metric_type, SmallInteger)
+    name = case(
+        *(
+            (codes == literal_column(str(code)), literal_column(f"'{member.value}'"))
+            for member, code in METRIC_TYPE_CODES.items()
+        )
+    )
+    return type_coerce(name, String).label("metric_type")
+
+
+def _id_str(sensor_id):
+    """Select sensor_id already as the string key used in results."""
+    return cast(sensor_id, String).label("sensor_id")
+
+
+# Statements are built once per (stat, filter shape) and reused with bound
+# parameters; repeated executions then also hit SQLAlchemy's compiled cache.
+def _filter_groups(q, model, by_sensor, by_metric):
+    """Apply sensor and metric type filters (column order of ix_metric_sensor_type_time)."""
+    if by_sensor:
+        q = q.where(model.sensor_id.in_(bindparam("sensor_ids", expanding=True)))
+    if by_metric:
+        q = q.where(model.metric_type.in_(bindparam("metric_types", expanding=True)))
+    return q
+
+
+@lru_cache(maxsize=None)
+def _raw_query(stat, by_sensor, by_metric, has_start, has_end):
+    """Aggregate directly over raw metric rows."""
     agg_map = {
-        "avg": func.avg(Metric.value),
-        "min": func.min(Metric.value),
-        "max": func.max(Metric.value),
-        "sum": func.sum(Metric.value),
+        Stat.AVG: func.avg(Metric.value),
+        Stat.MIN: func.min(Metric.value),
+        Stat.MAX: func.max(Metric.value),
+        Stat.SUM: func.sum(Metric.value),
+        Stat.COUNT: func.count(Metric.value),
     }
-    if stat not in agg_map:
-        raise ValueError("Unsupported stat")
-
-    agg_func = agg_map[stat]
 
+    # Ordered by group so callers can pivot rows without per-row dict lookups
     q = (
-        select(Metric.metric_type, Metric.sensor_id, agg_func.label("val"))
+        select(_as_str(Metric.metric_type), _id_str(Metric.sensor_id), agg_map[stat].label("val"))
         .group_by(Metric.metric_type, Metric.sensor_id)
+        .order_by(Metric.metric_type, Metric.sensor_id)
+    )
+    q = _filter_groups(q, Metric, by_sensor, by_metric)
+
+    if has_start:
+        q = q.where(Metric.timestamp >= bindparam("start"))
+    if has_end:
+        q = q.where(Metric.timestamp <= bindparam("end"))
+    return q
+
+
+@lru_cache(maxsize=None)
+def _rollup_query(stat, by_sensor, by_metric):
+    """Combine hourly rollups for [rolled_start, rolled_end) with raw rows for the rest.
+
+    Raw rows cover the partial hours at either edge of the range and every metric
+    newer than the rollup watermark; rollups cover the remaining whole hours.
+    """
+    rolled_start, rolled_end = bindparam("rolled_start"), bindparam("rolled_end")
+    raw = _filter_groups(
+        select(
+            Metric.metric_type,
+            Metric.sensor_id,
+            func.sum(Metric.value).label("value_sum"),
+            func.count(Metric.value).label("value_count"),
+            func.min(Metric.value).label("value_min"),
+            func.max(Metric.value).label("value_max"),
+        )
+        .where(
+            Metric.timestamp >= bindparam("start"),
+            Metric.timestamp <= bindparam("end"),
+            or_(
+                Metric.timestamp < rolled_start,
+                Metric.timestamp >= rolled_end,
+                Metric.id > watermark_subquery(),
+            ),
+        )
+        .group_by(Metric.metric_type, Metric.sensor_id),
+        Metric, by_sensor, by_metric,
+    )
+
+    Rollup = MetricRollupHourly
+    rolled = _filter_groups(
+        select(
+            Rollup.metric_type,
+            Rollup.sensor_id,
+            func.sum(Rollup.value_sum),
+            func.sum(Rollup.value_count),
+            func.min(Rollup.value_min),
+            func.max(Rollup.value_max),
+        )
+        .where(Rollup.bucket >= rolled_start, Rollup.bucket < rolled_end)
+        .group_by(Rollup.metric_type, Rollup.sensor_id),
+        Rollup, by_sensor, by_metric,
     )
 
-    if sensors:
-        q = q.where(Metric.sensor_id.in_(sensors))
+    parts = union_all(raw, rolled).subquery()
+    agg_map = {
+        Stat.AVG: func.sum(parts.c.value_sum) / cast(func.sum(parts.c.value_count), Float),
+        Stat.MIN: func.min(parts.c.value_min),
+        Stat.MAX: func.max(parts.c.value_max),
+        Stat.SUM: func.sum(parts.c.value_sum),
+        Stat.COUNT: func.sum(parts.c.value_count),
+    }
+    return (
+        select(_as_str(parts.c.metric_type), _id_str(parts.c.sensor_id), agg_map[stat].label("val"))
+        .group_by(parts.c.metric_type, parts.c.sensor_id)
+        .order_by(parts.c.metric_type, parts.c.sensor_id)
+    )
+
+
+@lru_cache(maxsize=None)
+def _jsonb_pivot(q):
+    """Wrap an aggregation so Postgres returns {metric_type: {sensor_id: val}} as one JSONB value."""
+    groups = q.subquery()
+    per_metric = (
+        select(
+            groups.c.metric_type,
+            func.jsonb_object_agg(groups.c.sensor_id, groups.c.val).label("by_sensor"),
+        )
+        .group_by(groups.c.metric_type)
+        .subquery()
+    )
+    return select(
+        func.jsonb_object_agg(per_metric.c.metric_type, per_metric.c.by_sensor, type_=JSONB)
+    )
 
-    if metrics:
-        q = q.where(Metric.metric_type.in_(metrics))
 
-    if start:
-        q = q.where(Metric.timestamp >= start)
-    if end:
-        q = q.where(Metric.timestamp <= end)
+def _pivot_rows(rows) -> dict[str, dict[str, Optional[float]]]:
+    """Pivot (metric_type, sensor_id, value) rows, ordered by metric type, into nested dicts.
 
+    Sensor ids arrive as strings (cast in SQL), so no per-row conversion is needed.
+    """
+    return {
+        metric_type: {sensor_id: value for _, sensor_id, value in group}
+        for metric_type, group in groupby(rows, key=itemgetter(0))
+    }
+
+
+async def aggregate_metrics(
+    db: AsyncSession,
+    stat: Stat,
+    sensors: Optional[List[int]],
+    metrics: Optional[List[MetricType]],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    use_rollups: bool = False,
+):
+    """Execute aggregated metrics query with performance monitoring.
+
+    Returns results pivoted as {metric_type: {sensor_id: value}}. On Postgres the
+    pivot is built in SQL; other backends pivot the ordered rows in Python.
+    With `use_rollups` (the refresh task is enabled), day-plus ranges read whole
+    hours from the hourly rollups.
+    """
+    start_ns = time.perf_counter_ns()
+
+    if stat not in SUPPORTED_STATS:
+        raise ValueError("Unsupported stat")
+
+    used_rollups = False
     try:
-        result = db.execute(q).all()
-        
-        # Log slow queries (>500ms)
-        execution_time = (time.time() - start_time) * 1000
-        if execution_time > 500:
-            logger.warning(f"Slow query detected", extra={
-                "execution_time_ms": round(execution_time, 2),
+        by_sensor, by_metric = bool(sensors), bool(metrics)
+        params = {"start": start, "end": end}
+        if by_sensor:
+            params["sensor_ids"] = sensors
+        if by_metric:
+            params["metric_types"] = metrics
+
+        q = _raw_query(stat, by_sensor, by_metric, start is not None, end is not None)
+        if use_rollups and start and end and end - start >= ROLLUP_MIN_RANGE:
+            rolled_start, rolled_end = ceil_hour(start), floor_hour(end)
+            # No watermark pre-check: the statement reads it itself, and with no
+            # rollups yet the raw side simply covers every metric
+            if rolled_start < rolled_end:
+                q = _rollup_query(stat, by_sensor, by_metric)
+                params.update(rolled_start=rolled_start, rolled_end=rolled_end)
+                used_rollups = True
+
+        if db.bind.dialect.name == "postgresql":
+            # jsonb_object_agg yields NULL when no group matched
+            result = (await db.execute(_jsonb_pivot(q), params)).scalar() or {}
+        else:
+            result = _pivot_rows((await db.execute(q, params)).all())
+
+        execution_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+        if execution_ms > SLOW_QUERY_THRESHOLD_MS:
+            logger.warning("Slow query detected", extra={
+                "execution_time_ms": round(execution_ms, 2),
                 "stat": stat,
                 "sensor_count": len(sensors) if sensors else "all",
                 "metric_types": metrics if metrics else "all",
                 "date_range": f"{start} to {end}" if start and end else "no_filter",
+                "used_rollups": used_rollups,
                 "result_count": len(result)
             })
         else:
-            logger.debug(f"Query completed", extra={
-                "execution_time_ms": round(execution_time, 2),
+            # Lazy: the payload is only built if a sink accepts DEBUG records
+            logger.opt(lazy=True).debug("Query completed", extra=lambda: {
+                "execution_time_ms": round(execution_ms, 2),
                 "stat": stat,
+                "used_rollups": used_rollups,
                 "result_count": len(result)
             })
-            
+
         return result
-        
+
     except Exception as e:
-        execution_time = (time.time() - start_time) * 1000
-        logger.error(f"Query failed: {e}", extra={
-            "execution_time_ms": round(execution_time, 2),
+        execution_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+        logger.error("Query failed: {}", e, extra={
+            "execution_time_ms": round(execution_ms, 2),
             "stat": stat,
             "sensors": sensors,
             "metrics": metrics
         })
-        raise
\ No newline at end of file
+        raise
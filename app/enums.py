@@ -9,3 +9,12 @@ class MetricType(str, Enum):
     TEMPERATURE = "temperature"
     HUMIDITY = "humidity"
     WIND_SPEED = "wind_speed"
+
+
+class Stat(str, Enum):
+    """Aggregation functions supported by the metrics query endpoint."""
+    AVG = "avg"
+    MIN = "min"
+    MAX = "max"
+    SUM = "sum"
+    COUNT = "count"
@@ -1,76 +1,161 @@
 # app/logging_config.py
 """Structured logging configuration with loguru for production observability."""
 
+import json
 import sys
 import time
+import orjson
 from loguru import logger
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Monotonic, integer-nanosecond clock for request timing
+_monotonic_ns = time.monotonic_ns
+
+# Datetimes go through default=str like loguru's json.dumps, not orjson's RFC 3339
+_ORJSON_OPTIONS = (
+    orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+)
+
+
+def _serialize_record(text: str, record: dict) -> bytes:
+    """Encode a record with orjson, in the same layout as loguru's serialize=True."""
+    exception = record["exception"]
+    if exception is not None:
+        exception = {
+            "type": None if exception.type is None else exception.type.__name__,
+            "value": exception.value,
+            "traceback": bool(exception.traceback),
+        }
+
+    payload = {
+        "text": text,
+        "record": {
+            "elapsed": {
+                "repr": record["elapsed"],
+                "seconds": record["elapsed"].total_seconds(),
+            },
+            "exception": exception,
+            "extra": record["extra"],
+            "file": {"name": record["file"].name, "path": record["file"].path},
+            "function": record["function"],
+            "level": {
+                "icon": record["level"].icon,
+                "name": record["level"].name,
+                "no": record["level"].no,
+            },
+            "line": record["line"],
+            "message": record["message"],
+            "module": record["module"],
+            "name": record["name"],
+            "process": {"id": record["process"].id, "name": record["process"].name},
+            "thread": {"id": record["thread"].id, "name": record["thread"].name},
+            "time": {"repr": record["time"], "timestamp": record["time"].timestamp()},
+        },
+    }
+    try:
+        # default=str covers datetimes, timedeltas, exception values and arbitrary extras
+        return orjson.dumps(payload, default=str, option=_ORJSON_OPTIONS)
+    except TypeError:
+        # orjson rejects ints wider than 64 bits and some non-str keys; never drop the record
+        return (json.dumps(payload, default=str, ensure_ascii=False) + "\n").encode()
 
 
 def setup_logging(log_level: str = "INFO") -> None:
     """Configure structured JSON logging for production."""
     # Remove default logger
     logger.remove()
-    
+    debug = log_level.upper() == "DEBUG"
+
+    # orjson emits UTF-8 bytes, written straight to the underlying binary stream
+    write = sys.stdout.buffer.write
+    flush = sys.stdout.buffer.flush
+
+    def json_sink(message) -> None:
+        write(_serialize_record(message, message.record))
+        flush()
+
     # Add structured JSON logger for production
     logger.add(
-        sys.stdout,
+        json_sink,
         format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level} | {name}:{function}:{line} | {message}",
         level=log_level,
-        serialize=True,  # JSON output
-        backtrace=True,  # Include stack traces
-        diagnose=True,   # Include variable values in tracebacks
+        enqueue=True,    # Callers only enqueue; a background thread serializes and writes
+        # Extended tracebacks with variable values walk every frame and can leak
+        # data; only enabled when debugging
+        backtrace=debug,
+        diagnose=debug,
     )
 
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware to log all HTTP requests with timing and error handling."""
+# Built once; level names (not numbers) keep "INFO"/"WARNING" in the records
+_lazy_log = logger.opt(lazy=True).log
+
+# Probed constantly by orchestrators; logging them only adds noise and overhead
+UNLOGGED_PATHS = frozenset({"/healthz"})
+
+
+def _request_info(scope: Scope) -> dict:
+    """Request fields shared by every access log record, read straight from the ASGI scope."""
+    query_string = scope.get("query_string", b"")
+    client = scope.get("client")
+    return {
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": query_string.decode("latin-1") if query_string else "",
+        "client_ip": client[0] if client else "unknown",
+    }
+
 
-    async def dispatch(self, request: Request, call_next) -> Response:
+class RequestLoggingMiddleware:
+    """Pure ASGI middleware to log all HTTP requests with timing and error handling.
+
+    The status code is read from the ``http.response.start`` message, avoiding
+    BaseHTTPMiddleware's extra task and body-streaming hop per request.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Log request details and response times."""
-        start_time = time.time()
-        
-        # Extract request info
-        method = request.method
-        path = request.url.path
-        query = str(request.query_params) if request.query_params else ""
-        client_ip = request.client.host if request.client else "unknown"
-        
+        if scope["type"] != "http" or scope["path"] in UNLOGGED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start_ns = _monotonic_ns()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
         try:
-            response = await call_next(request)
-            process_time = (time.time() - start_time) * 1000  # Convert to milliseconds
-            
-            # Log successful requests
-            log_data = {
-                "method": method,
-                "path": path,
-                "query": query,
-                "status_code": response.status_code,
-                "process_time_ms": round(process_time, 2),
-                "client_ip": client_ip
-            }
-            
-            if response.status_code >= 400:
-                logger.warning(f"HTTP {response.status_code}", extra=log_data)
-            else:
-                logger.info(f"HTTP {response.status_code}", extra=log_data)
-                
-            return response
-            
+            await self.app(scope, receive, send_with_status)
         except Exception as exc:
-            process_time = (time.time() - start_time) * 1000
-            
+            elapsed_ns = _monotonic_ns() - start_ns
+
             # Log errors with stack traces
             log_data = {
-                "method": method,
-                "path": path,
-                "query": query,
-                "process_time_ms": round(process_time, 2),
-                "client_ip": client_ip,
+                **_request_info(scope),
+                "process_time_us": elapsed_ns // 1000,
                 "error": str(exc),
                 "error_type": type(exc).__name__
             }
-            
-            logger.error(f"Request failed: {exc}", extra=log_data)
+
+            logger.error("Request failed: {}", exc, extra=log_data)
             raise  # Re-raise the exception
+
+        elapsed_ns = _monotonic_ns() - start_ns
+
+        # Lazy: request fields are only extracted if a sink accepts the record
+        log_data = lambda: {
+            **_request_info(scope),
+            "status_code": status_code,
+            "process_time_us": elapsed_ns // 1000,
+        }
+
+        level = "WARNING" if status_code >= 400 else "INFO"
+        _lazy_log(level, "HTTP {}", lambda: status_code, extra=log_data)
@@ -1,66 +1,104 @@
 # app/main.py
 """Application entry point and FastAPI app factory."""
 
+import asyncio
 import os
-from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+import orjson
+from fastapi import FastAPI, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from loguru import logger
 
-from app.database import Base, engine
+from app.cache import QueryCache
+from app.database import SessionLocal, create_missing_tables, engine
+from app.responses import JSONResponse
 from app.logging_config import setup_logging, RequestLoggingMiddleware
+from app.middleware import AllowAllCORSMiddleware
+from app.rollups import run_rollup_loop
 from api import sensors as sensors_router
 from api import metrics as metrics_router
 
+# Static bodies of the meta endpoints, encoded once. Only the bytes are shared:
+# middleware may mutate a Response's headers, so each request gets a fresh one.
+_ROOT_BODY = orjson.dumps({"message": "Climate Stats API"})
+_HEALTH_BODY = orjson.dumps({"status": "ok"})
 
+
+@lru_cache(maxsize=1)
 def create_app() -> FastAPI:
-    """Create and configure the FastAPI application instance."""
+    """Create and configure the FastAPI application instance.
+
+    Cached: repeated calls in one process (entry points, tests) share a single app.
+    """
     
     # Configure structured logging
     log_level = os.getenv("LOG_LEVEL", "INFO")
     setup_logging(log_level)
     logger.info("Starting Climate Stats API", extra={"log_level": log_level})
 
+    # Hourly rollup refresh period; off unless ROLLUP_INTERVAL_SECONDS is set (e.g. 300)
+    rollup_interval = float(os.getenv("ROLLUP_INTERVAL_SECONDS", "0"))
+
     @asynccontextmanager
     async def lifespan(app: FastAPI):
         # Development convenience: auto-create tables at startup.
         # In production, replace with Alembic migrations.
         logger.info("Initializing database tables")
-        Base.metadata.create_all(bind=engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(create_missing_tables)
+        rollup_task = None
+        if rollup_interval > 0:
+            rollup_task = asyncio.create_task(
+                run_rollup_loop(app.state.session_factory, rollup_interval)
+            )
         logger.info("Application startup complete")
         yield
         logger.info("Application shutdown")
-        # Optional teardown logic can be added here if needed.
+        if rollup_task is not None:
+            rollup_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await rollup_task
+        await engine.dispose()
 
     app = FastAPI(
         title="Climate Stats API",
         version="1.0.0",
         docs_url="/docs",
         redoc_url=None,
+        default_response_class=JSONResponse,
         lifespan=lifespan,
     )
 
+    # Per-app cache for aggregation results; QUERY_CACHE_TTL=0 disables it
+    app.state.query_cache = QueryCache(
+        ttl=float(os.getenv("QUERY_CACHE_TTL", "60")),
+        max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024")),
+    )
+    # Queries only read rollups when the refresh task keeps them up to date
+    app.state.rollups_enabled = rollup_interval > 0
+    # Session factory for background tasks (overridden together with get_db in tests)
+    app.state.session_factory = SessionLocal
+
+    # Compress larger responses (multi-sensor query results); innermost, so
+    # request timing includes compression
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
     # Add request logging middleware
     app.add_middleware(RequestLoggingMiddleware)
     
     # CORS middleware: permissive for demo purposes; restrict in production.
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
+    app.add_middleware(AllowAllCORSMiddleware)
 
     # Root route - meta endpoint
     @app.get("/", tags=["meta"])
-    def root() -> dict:
-        return {"message": "Climate Stats API"}
+    async def root() -> Response:
+        return Response(content=_ROOT_BODY, media_type="application/json")
 
     # Healthcheck endpoint (used by tests and orchestration systems)
     @app.get("/healthz", tags=["health"])
-    def healthz() -> dict:
-        return {"status": "ok"}
+    async def healthz() -> Response:
+        return Response(content=_HEALTH_BODY, media_type="application/json")
 
     # Register routers (each API module exposes a `router` object)
     app.include_router(sensors_router.router)
@@ -0,0 +1,65 @@
+# app/middleware.py
+"""Pure ASGI middleware with precomputed, static behaviour."""
+
+from __future__ import annotations
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ALLOWED_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+
+class AllowAllCORSMiddleware:
+    """CORS for any origin, method and header, with credentials.
+
+    Behaves like Starlette's CORSMiddleware configured with wildcards and
+    allow_credentials=True (the request origin is echoed back, since browsers
+    reject "*" with credentials), but every static header is built once
+    instead of re-matching the configuration per request.
+    """
+
+    def __init__(self, app: ASGIApp, max_age: int = 600) -> None:
+        self.app = app
+        self.simple_headers = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        self.preflight_headers = [
+            (b"access-control-allow-methods", ALLOWED_METHODS),
+            (b"access-control-max-age", str(max_age).encode()),
+            *self.simple_headers,
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = [(b"access-control-allow-origin", origin), *self.preflight_headers]
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cors_headers = [(b"access-control-allow-origin", origin), *self.simple_headers]
+
+        async def send_with_cors(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
@@ -13,15 +13,62 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Index,
-    func,
-    Enum as SQLEnum,
+    SmallInteger,
+    TypeDecorator,
 )
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql.functions import FunctionElement
 
 from app.database import Base
 from app.enums import MetricType
 
 
+class utcnow(FunctionElement):
+    """Current UTC timestamp, rendered per dialect for use as a server default."""
+
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw) -> str:
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw) -> str:
+    # Same text layout SQLAlchemy writes for Python datetimes, so stored values
+    # compare consistently (CURRENT_TIMESTAMP would drop the fractional part)
+    return "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+# Stored codes for each metric type; append new types, never renumber
+METRIC_TYPE_CODES = {
+    MetricType.TEMPERATURE: 1,
+    MetricType.HUMIDITY: 2,
+    MetricType.WIND_SPEED: 3,
+}
+_METRIC_TYPES_BY_CODE = {code: metric_type for metric_type, code in METRIC_TYPE_CODES.items()}
+
+
+class MetricTypeCode(TypeDecorator):
+    """MetricType persisted as a SMALLINT code: narrower rows and index keys than text."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return METRIC_TYPE_CODES[MetricType(value)]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return _METRIC_TYPES_BY_CODE[value]
+
+
 class Sensor(Base):
     """Weather sensor: uniquely named entity that emits metrics over time."""
 
@@ -44,23 +91,22 @@ class Metric(Base):
 
     __tablename__ = "metrics"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    # The primary key and the composite indexes below already cover id and sensor_id lookups
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
     sensor_id: Mapped[int] = mapped_column(
         ForeignKey("sensors.id", ondelete="CASCADE"),
-        index=True,
         nullable=False,
     )
-    # Enum type ensures data integrity at database level
+    # Only MetricType values can be bound, so stored codes always map back to a type
     metric_type: Mapped[MetricType] = mapped_column(
-        SQLEnum(MetricType, native_enum=False), 
+        MetricTypeCode(),
         nullable=False
     )
     value: Mapped[float] = mapped_column(Float, nullable=False)
 
     timestamp: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
-        server_default=func.now(),
-        index=True,
+        server_default=utcnow(),
         nullable=False,
     )
 
@@ -69,5 +115,46 @@ class Metric(Base):
     # Helpful composite indexes for query performance
     __table_args__ = (
         Index("ix_metric_sensor_time", "sensor_id", "timestamp"),
-        Index("ix_metric_sensor_type_time", "sensor_id", "metric_type", "timestamp"),
-    )
\ No newline at end of file
+        # Covers aggregate_metrics: sensor_id IN, metric_type IN, timestamp range;
+        # trailing value makes it covering, so aggregates never touch the table
+        Index("ix_metric_sensor_type_time", "sensor_id", "metric_type", "timestamp", "value"),
+        # Postgres: compact block-range index for wide time-range scans, in place of a B-tree
+        Index(
+            "ix_metric_ts_brin",
+            "timestamp",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ).ddl_if(dialect="postgresql"),
+        # Other backends keep a regular B-tree on timestamp
+        Index("ix_metrics_timestamp", "timestamp").ddl_if(
+            callable_=lambda ddl, target, bind, dialect=None, **kw: dialect.name != "postgresql"
+        ),
+    )
+
+
+class MetricRollupHourly(Base):
+    """Pre-aggregated metrics per sensor, metric type and UTC hour (see app.rollups)."""
+
+    __tablename__ = "metric_rollup_hourly"
+
+    sensor_id: Mapped[int] = mapped_column(
+        ForeignKey("sensors.id", ondelete="CASCADE"), primary_key=True
+    )
+    metric_type: Mapped[MetricType] = mapped_column(
+        MetricTypeCode(), primary_key=True
+    )
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+
+    value_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    value_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    value_min: Mapped[float] = mapped_column(Float, nullable=False)
+    value_max: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class MetricRollupWatermark(Base):
+    """Single-row table: every metric with id <= last_metric_id is folded into the rollups."""
+
+    __tablename__ = "metric_rollup_watermark"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    last_metric_id: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -0,0 +1,17 @@
+# app/responses.py
+"""JSON response class backed by orjson."""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+class JSONResponse(ORJSONResponse):
+    """ORJSONResponse rendering datetimes like Pydantic: UTC with a 'Z' suffix."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z,
+        )
@@ -0,0 +1,195 @@
+# app/rollups.py
+"""Hourly metric rollups, refreshed by a background task and read by aggregate_metrics.
+
+Rollups hold (sum, count, min, max) per sensor, metric type and UTC hour for every
+metric with ``id <= watermark``. Queries combine them with raw rows for partial
+hours and for metrics newer than the watermark, so results stay exact while the
+rollups lag behind ingestion.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from fastapi import Request
+from loguru import logger
+from sqlalchemy import and_, func, literal_column, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models import Metric, MetricRollupHourly, MetricRollupWatermark
+
+WATERMARK_ID = 1
+HOUR = timedelta(hours=1)
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE support
+_UPSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+_ROLLUP_VALUES = ("value_sum", "value_count", "value_min", "value_max")
+
+# Upper bound on time ranges per rebuild statement, keeping the WHERE clause small
+_RANGES_PER_STATEMENT = 100
+
+
+def floor_hour(value: datetime) -> datetime:
+    """Truncate a datetime to the start of its hour."""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(value: datetime) -> datetime:
+    """Round a datetime up to the next hour boundary (unchanged if already aligned)."""
+    floored = floor_hour(value)
+    return floored if floored == value else floored + HOUR
+
+
+def _hour_ranges(hours: Iterable[datetime]) -> list[tuple[datetime, datetime]]:
+    """Merge hour starts into sorted [start, end) ranges of consecutive hours."""
+    ranges: list[tuple[datetime, datetime]] = []
+    for hour in sorted(hours):
+        if ranges and ranges[-1][1] == hour:
+            ranges[-1] = (ranges[-1][0], hour + HOUR)
+        else:
+            ranges.append((hour, hour + HOUR))
+    return ranges
+
+
+def hour_bucket(column, dialect_name: str):
+    """SQL expression truncating a timestamp column to its UTC hour."""
+    # Constants are inlined so SELECT and GROUP BY render the identical expression
+    if dialect_name == "postgresql":
+        utc = literal_column("'UTC'")
+        return func.timezone(utc, func.date_trunc(literal_column("'hour'"), func.timezone(utc, column)))
+    # SQLite stores timestamps as text; keep SQLAlchemy's layout so comparisons stay consistent
+    return func.strftime(literal_column("'%Y-%m-%d %H:00:00.000000'"), column)
+
+
+def _watermark_select():
+    return select(MetricRollupWatermark.last_metric_id).where(
+        MetricRollupWatermark.id == WATERMARK_ID
+    )
+
+
+def watermark_subquery():
+    """The watermark as a scalar subquery (0 if none).
+
+    Read inside the statement that combines rollups with raw rows, so both sides
+    see the same snapshot even if a fold commits concurrently.
+    """
+    return func.coalesce(_watermark_select().scalar_subquery(), 0)
+
+
+async def get_watermark(db: AsyncSession) -> int:
+    """Return the highest metric id already folded into the rollups (0 if none)."""
+    return (await db.execute(_watermark_select())).scalar() or 0
+
+
+async def fold_metrics(db: AsyncSession, up_to_id: int) -> None:
+    """Fold metrics with watermark < id <= up_to_id into the hourly rollups."""
+    dialect_name = db.bind.dialect.name
+    upsert = _UPSERT.get(dialect_name)
+    if upsert is None:
+        logger.warning("Hourly rollups are not supported on {}", dialect_name)
+        return
+
+    # Folds are serialized: the no-op insert takes SQLite's write lock and makes sure
+    # the watermark row exists, which FOR UPDATE then locks on Postgres until commit
+    await db.execute(
+        upsert(MetricRollupWatermark)
+        .values(id=WATERMARK_ID, last_metric_id=0)
+        .on_conflict_do_nothing(index_elements=["id"])
+    )
+    last_id = (await db.execute(_watermark_select().with_for_update())).scalar()
+    if up_to_id <= last_id:
+        # Another process already folded these ids
+        await db.rollback()
+        return
+
+    # Only the hours touched by the new metrics are recomputed, in full, which
+    # also covers late-arriving readings for hours that were already rolled up
+    bucket = hour_bucket(Metric.timestamp, dialect_name)
+    touched = (
+        await db.execute(
+            select(bucket).where(Metric.id > last_id, Metric.id <= up_to_id).distinct()
+        )
+    ).scalars()
+    ranges = _hour_ranges(
+        hour if isinstance(hour, datetime) else datetime.fromisoformat(hour) for hour in touched
+    )
+
+    for offset in range(0, len(ranges), _RANGES_PER_STATEMENT):
+        batch = ranges[offset:offset + _RANGES_PER_STATEMENT]
+        source = (
+            select(
+                Metric.sensor_id,
+                Metric.metric_type,
+                bucket,
+                func.sum(Metric.value),
+                func.count(Metric.value),
+                func.min(Metric.value),
+                func.max(Metric.value),
+            )
+            .where(
+                Metric.id <= up_to_id,
+                or_(*(
+                    and_(Metric.timestamp >= start, Metric.timestamp < end)
+                    for start, end in batch
+                )),
+            )
+            .group_by(Metric.sensor_id, Metric.metric_type, bucket)
+        )
+        stmt = upsert(MetricRollupHourly).from_select(
+            ["sensor_id", "metric_type", "bucket", *_ROLLUP_VALUES], source
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["sensor_id", "metric_type", "bucket"],
+            set_={name: stmt.excluded[name] for name in _ROLLUP_VALUES},
+        )
+        await db.execute(stmt)
+
+    # Never moves backwards, even if a fold with a lower up_to_id slipped through
+    await db.execute(
+        update(MetricRollupWatermark)
+        .where(
+            MetricRollupWatermark.id == WATERMARK_ID,
+            MetricRollupWatermark.last_metric_id < up_to_id,
+        )
+        .values(last_metric_id=up_to_id)
+    )
+    await db.commit()
+
+    logger.opt(lazy=True).info("Hourly rollups refreshed", extra=lambda: {
+        "from_metric_id": last_id,
+        "to_metric_id": up_to_id,
+    })
+
+
+async def refresh_rollups(db: AsyncSession, up_to_id: Optional[int]) -> Optional[int]:
+    """Run one refresh pass and return the metric id to fold on the next pass.
+
+    Only ids observed on the previous pass are folded: ids handed out to
+    transactions that were still open at that time have committed by now,
+    so no metric can be skipped by the watermark.
+    """
+    next_up_to = (await db.execute(select(func.max(Metric.id)))).scalar()
+    if up_to_id is not None:
+        await fold_metrics(db, up_to_id)
+    return next_up_to
+
+
+def rollups_enabled(request: Request) -> bool:
+    """FastAPI dependency: whether the refresh task runs, so queries may read rollups."""
+    return getattr(request.app.state, "rollups_enabled", False)
+
+
+async def run_rollup_loop(session_factory: async_sessionmaker, interval: float) -> None:
+    """Refresh hourly rollups every `interval` seconds until cancelled."""
+    up_to_id: Optional[int] = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                up_to_id = await refresh_rollups(db, up_to_id)
+        except Exception as e:
+            logger.error("Hourly rollup refresh failed: {}", e)
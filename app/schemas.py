@@ -1,5 +1,5 @@
 # app/schemas.py
-from pydantic import BaseModel, field_validator, ValidationError, ConfigDict, Field
+from pydantic import BaseModel, field_validator, ValidationError, ConfigDict, Field, TypeAdapter
 from datetime import datetime
 from typing import List, Optional, Dict, Union
 
@@ -10,6 +10,14 @@ from app.enums import MetricType
 # Metric Schemas
 # -------------------------
 
+# Realistic (min, max, unit) ranges for each metric type
+METRIC_RANGES = {
+    MetricType.TEMPERATURE: (-50.0, 60.0, "°C"),
+    MetricType.HUMIDITY: (0.0, 100.0, "%"),
+    MetricType.WIND_SPEED: (0.0, 200.0, "km/h"),
+}
+
+
 class MetricBase(BaseModel):
     metric_type: MetricType
     value: float
@@ -18,20 +26,12 @@ class MetricBase(BaseModel):
     @classmethod
     def validate_value_range(cls, v: float, info) -> float:
         """Validate metric values are within realistic ranges for their type."""
-        if 'metric_type' not in info.data:
-            return v
-        
-        metric_type = info.data['metric_type']
+        # metric_type is absent from info.data when it failed validation itself
+        metric_type = info.data.get('metric_type')
+        bounds = METRIC_RANGES.get(metric_type)
         
-        # Define realistic ranges for each metric type
-        ranges = {
-            MetricType.TEMPERATURE: (-50.0, 60.0, "°C"),
-            MetricType.HUMIDITY: (0.0, 100.0, "%"),
-            MetricType.WIND_SPEED: (0.0, 200.0, "km/h")
-        }
-        
-        if metric_type in ranges:
-            min_val, max_val, unit = ranges[metric_type]
+        if bounds is not None:
+            min_val, max_val, unit = bounds
             if not (min_val <= v <= max_val):
                 raise ValueError(
                     f"{metric_type.value} must be between {min_val} and {max_val} {unit}, got {v}"
@@ -52,6 +52,22 @@ class Metric(MetricBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+    @classmethod
+    def from_orm_fast(cls, obj) -> "Metric":
+        """Build from an ORM metric without re-validating a row the database already typed."""
+        return cls.model_construct(
+            metric_type=obj.metric_type,
+            value=obj.value,
+            id=obj.id,
+            sensor_id=obj.sensor_id,
+            timestamp=obj.timestamp,
+        )
+
+
+class MetricBulkOut(BaseModel):
+    inserted: int
+    ids: List[int]
+
 
 # -------------------------
 # Sensor Schemas
@@ -71,6 +87,18 @@ class Sensor(SensorBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+    @classmethod
+    def from_orm_fast(cls, obj) -> "Sensor":
+        """Build from an ORM sensor without re-validating rows the database already typed."""
+        return cls.model_construct(
+            name=obj.name,
+            id=obj.id,
+            metrics=[Metric.from_orm_fast(m) for m in obj.metrics],
+        )
+
+
+SENSOR_LIST_ADAPTER = TypeAdapter(List[Sensor])
+
 
 # -------------------------
 # Metric Query Schemas
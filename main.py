@@ -5,4 +5,14 @@ app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop/httptools ship with uvicorn[standard]; request logs come from
+    # RequestLoggingMiddleware, so uvicorn's own logging config and access log are off
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        log_config=None,
+        access_log=False,
+    )
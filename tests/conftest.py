@@ -0,0 +1,107 @@
+# tests/conftest.py
+"""Shared fixtures: one app and in-memory schema per session, one rolled-back transaction per test."""
+
+import os
+
+# Test mode: the app's engine uses one shared in-memory SQLite database (StaticPool).
+# Set before importing the app, which builds its engine at import time. Forced, not
+# defaulted: an exported DATABASE_URL must never receive the suite's DDL and writes,
+# and the SAVEPOINT listeners below are SQLite-specific.
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite://"
+# No background rollup task: its commits would share the StaticPool connection
+# that holds each test's outer transaction and end it mid-test
+os.environ["ROLLUP_INTERVAL_SECONDS"] = "0"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from api.metrics import query_metrics_fast
+from app.cache import QueryCache
+from app.database import engine, get_db
+from app.main import create_app
+
+
+@pytest.fixture(scope="session")
+def test_engine():
+    """The app's engine, with transactions that support SAVEPOINT rollback."""
+    # The sqlite3 driver manages transactions itself and breaks SAVEPOINT;
+    # hand transaction control to SQLAlchemy (documented pysqlite/aiosqlite recipe)
+    @event.listens_for(engine.sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine.sync_engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+    
+    return engine
+
+
+@pytest.fixture(scope="session")
+def session_client(test_engine):
+    """Run app startup (which creates the schema) and shutdown once per test session."""
+    app = create_app()
+    # Build the OpenAPI schema up front rather than inside the first test using it
+    app.openapi()
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def test_client(session_client, test_engine):
+    """Client whose database writes are rolled back after each test.
+    
+    Every session joins one outer transaction on a dedicated connection;
+    application commits and rollbacks only release or roll back SAVEPOINTs.
+    """
+    app = session_client.app
+    portal = session_client.portal
+    
+    connection = portal.call(test_engine.connect)
+    transaction = portal.call(connection.begin)
+    TestingSessionLocal = async_sessionmaker(
+        bind=connection,
+        autoflush=False,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
+    
+    # Override database dependency
+    async def override_get_db():
+        async with TestingSessionLocal() as db:
+            yield db
+    
+    app.dependency_overrides[get_db] = override_get_db
+    app.state.session_factory = TestingSessionLocal
+    # Fresh cache so results and hit counters never leak between tests
+    app.state.query_cache = QueryCache()
+    
+    yield session_client
+    
+    app.dependency_overrides.clear()
+    portal.call(transaction.rollback)
+    portal.call(connection.close)
+
+
+@pytest.fixture(params=["fast_parser", "declarative_parser"])
+def query_client(request, test_client):
+    """test_client, run once per /metrics/query implementation (see FAST_QUERY_PARSER)."""
+    routes = test_client.app.router.routes
+    fast = [
+        (index, route) for index, route in enumerate(routes)
+        if getattr(route, "endpoint", None) is query_metrics_fast
+    ]
+    if request.param == "fast_parser":
+        if not fast:
+            pytest.skip("FAST_QUERY_PARSER=0")
+        yield test_client
+        return
+    
+    # Unregister the fast route so the declarative one serves the path
+    for _, route in fast:
+        routes.remove(route)
+    yield test_client
+    for index, route in fast:
+        routes.insert(index, route)
@@ -1,51 +1,16 @@
 # tests/test_api.py
 """Comprehensive test suite with proper isolation and negative testing."""
 
-import pytest
-import tempfile
-import os
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from app.main import create_app
-from app.database import Base, get_db
-
-
-@pytest.fixture
-def test_client():
-    """Create isolated test client with fresh database for each test."""
-    # Create temporary database file for isolation
-    db_fd, db_path = tempfile.mkstemp(suffix='.db')
-    test_database_url = f"sqlite:///{db_path}"
-    
-    # Create test engine and session
-    test_engine = create_engine(
-        test_database_url, 
-        connect_args={"check_same_thread": False}
-    )
-    TestingSessionLocal = sessionmaker(bind=test_engine, autoflush=False, autocommit=False)
-    
-    # Create tables
-    Base.metadata.create_all(bind=test_engine)
-    
-    # Override database dependency
-    def override_get_db():
-        db = TestingSessionLocal()
-        try:
-            yield db
-        finally:
-            db.close()
-    
-    app = create_app()
-    app.dependency_overrides[get_db] = override_get_db
-    
-    with TestClient(app) as client:
-        yield client
-    
-    # Cleanup
-    os.close(db_fd)
-    os.unlink(db_path)
+import json
+from datetime import datetime, timedelta, timezone
+from loguru import logger
+from sqlalchemy import event, func, select
+
+from api import metrics as metrics_api
+from api.metrics import _parse_known_query
+from app.logging_config import _serialize_record
+from app.models import MetricRollupHourly
+from app.rollups import fold_metrics, refresh_rollups
 
 
 # ================================
@@ -66,6 +31,25 @@ def test_root_endpoint_returns_api_info(test_client):
     assert response.json() == {"message": "Climate Stats API"}
 
 
+def test_cors_echoes_origin_on_preflight_and_requests(test_client):
+    """Any origin should be allowed, echoed back with credentials."""
+    origin = "https://dashboard.example.com"
+    preflight = test_client.options("/sensors/", headers={
+        "Origin": origin,
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "content-type",
+    })
+    assert preflight.status_code == 204
+    assert preflight.headers["access-control-allow-origin"] == origin
+    assert preflight.headers["access-control-allow-headers"] == "content-type"
+    assert "POST" in preflight.headers["access-control-allow-methods"]
+    
+    response = test_client.get("/healthz", headers={"Origin": origin})
+    assert response.headers["access-control-allow-origin"] == origin
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert "access-control-allow-origin" not in test_client.get("/healthz").headers
+
+
 # ================================
 # Sensor Management Tests
 # ================================
@@ -116,6 +100,17 @@ def test_list_sensors_after_creation(test_client):
     assert sensors[1]["name"] == "sensor-2"
 
 
+def test_list_sensors_paginated(test_client):
+    """limit/offset should page through sensors in id order."""
+    for i in range(5):
+        test_client.post("/sensors/", json={"name": f"paged-{i}"})
+    
+    page = test_client.get("/sensors/?limit=2&offset=3").json()
+    assert [s["name"] for s in page] == ["paged-3", "paged-4"]
+    
+    assert test_client.get("/sensors/?limit=0").status_code == 422
+
+
 def test_get_sensor_by_id_success(test_client):
     """Getting sensor by valid ID should return sensor data."""
     # Create sensor
@@ -206,6 +201,39 @@ def test_create_metric_nonexistent_sensor_fails(test_client):
     assert "not found" in response.json()["detail"].lower()
 
 
+def test_create_metrics_bulk_success(query_client):
+    """Bulk ingestion should insert every metric and return their IDs in order."""
+    sensor_id = query_client.post("/sensors/", json={"name": "bulk-sensor"}).json()["id"]
+    
+    response = query_client.post("/metrics/bulk", json=[
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": 20.0},
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": 30.0},
+        {"sensor_id": sensor_id, "metric_type": "humidity", "value": 55.0},
+    ])
+    
+    assert response.status_code == 201
+    assert response.json() == {"inserted": 3, "ids": [1, 2, 3]}
+    
+    query = query_client.get(f"/metrics/query?stat=avg&sensors={sensor_id}&metrics=temperature")
+    assert query.json()["results"]["temperature"][str(sensor_id)] == 25.0
+
+
+def test_create_metrics_bulk_unknown_sensor_inserts_nothing(query_client):
+    """Bulk ingestion referencing a missing sensor should return 404 and insert nothing."""
+    sensor_id = query_client.post("/sensors/", json={"name": "bulk-sensor"}).json()["id"]
+    
+    response = query_client.post("/metrics/bulk", json=[
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": 20.0},
+        {"sensor_id": 999, "metric_type": "temperature", "value": 21.0},
+    ])
+    
+    assert response.status_code == 404
+    assert "999" in response.json()["detail"]
+    
+    query = query_client.get(f"/metrics/query?stat=sum&sensors={sensor_id}&metrics=temperature")
+    assert query.json()["results"]["temperature"][str(sensor_id)] is None
+
+
 # ================================
 # Metric Validation - Negative Tests
 # ================================
@@ -331,21 +359,21 @@ def test_create_metric_wind_speed_too_high_fails(test_client):
 # Query Endpoint Tests
 # ================================
 
-def test_query_metrics_basic_aggregation(test_client):
+def test_query_metrics_basic_aggregation(query_client):
     """Basic metric query should return aggregated results."""
     # Setup: create sensor and metrics
-    sensor_response = test_client.post("/sensors/", json={"name": "query-sensor"})
+    sensor_response = query_client.post("/sensors/", json={"name": "query-sensor"})
     sensor_id = sensor_response.json()["id"]
     
     # Add some test data
-    test_client.post("/metrics/", json={
+    query_client.post("/metrics/", json={
         "sensor_id": sensor_id, "metric_type": "temperature", "value": 20.0
     })
-    test_client.post("/metrics/", json={
+    query_client.post("/metrics/", json={
         "sensor_id": sensor_id, "metric_type": "temperature", "value": 25.0
     })
     
-    response = test_client.get(f"/metrics/query?stat=avg&sensors={sensor_id}&metrics=temperature")
+    response = query_client.get(f"/metrics/query?stat=avg&sensors={sensor_id}&metrics=temperature")
     
     assert response.status_code == 200
     data = response.json()
@@ -353,28 +381,215 @@ def test_query_metrics_basic_aggregation(test_client):
     assert str(sensor_id) in data["results"]["temperature"]  # API returns sensor IDs as strings
 
 
-def test_query_metrics_all_stats_work(test_client):
-    """All stat types (avg, min, max, sum) should work."""
+def test_query_metrics_all_stats_work(query_client):
+    """All stat types (avg, min, max, sum, count) should work."""
     # Setup: create sensor and metric
-    sensor_response = test_client.post("/sensors/", json={"name": "stats-sensor"})
+    sensor_response = query_client.post("/sensors/", json={"name": "stats-sensor"})
     sensor_id = sensor_response.json()["id"]
-    test_client.post("/metrics/", json={
+    query_client.post("/metrics/", json={
         "sensor_id": sensor_id, "metric_type": "temperature", "value": 25.0
     })
     
-    stats = ["avg", "min", "max", "sum"]
+    base = f"/metrics/query?sensors={sensor_id}&metrics=temperature"
+    stats = ["avg", "min", "max", "sum", "count"]
     for stat in stats:
-        response = test_client.get(f"/metrics/query?stat={stat}&sensors={sensor_id}&metrics=temperature")
+        response = query_client.get(f"{base}&stat={stat}")
         assert response.status_code == 200, f"Stat '{stat}' failed"
+    
+    assert response.json()["results"]["temperature"][str(sensor_id)] == 1
+
+
+def test_query_results_cached_until_next_write(query_client):
+    """Repeated queries should hit the cache; a new metric should invalidate it."""
+    sensor_id = query_client.post("/sensors/", json={"name": "cached-sensor"}).json()["id"]
+    query_client.post("/metrics/", json={"sensor_id": sensor_id, "metric_type": "temperature", "value": 10.0})
+    cache = query_client.app.state.query_cache
+    url = f"/metrics/query?stat=sum&sensors={sensor_id}&metrics=temperature"
+    
+    first = query_client.get(url).json()["results"]["temperature"][str(sensor_id)]
+    second = query_client.get(url).json()["results"]["temperature"][str(sensor_id)]
+    assert first == second == 10.0
+    assert cache.hits == 1
+    
+    query_client.post("/metrics/", json={"sensor_id": sensor_id, "metric_type": "temperature", "value": 5.0})
+    third = query_client.get(url).json()["results"]["temperature"][str(sensor_id)]
+    assert third == 15.0
+
+
+def test_query_windows_sharing_a_cache_key_share_results(query_client):
+    """Windows widening to the same minutes must both be answered over that widened window."""
+    sensor_id = query_client.post("/sensors/", json={"name": "window-sensor"}).json()["id"]
+    minute = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(hours=1)
+    query_client.post("/metrics/", json={
+        "sensor_id": sensor_id, "metric_type": "temperature", "value": 3.0,
+        "timestamp": (minute - timedelta(seconds=25)).isoformat(),
+    })
+    
+    # The reading lies after the first end but before the second; both widen to `minute`
+    for end in (minute - timedelta(seconds=40), minute - timedelta(seconds=10)):
+        response = query_client.get("/metrics/query", params={
+            "stat": "sum", "sensors": sensor_id, "metrics": "temperature",
+            "start": (end - timedelta(days=2)).isoformat(), "end": end.isoformat(),
+        }).json()
+        assert datetime.fromisoformat(response["end"]) == minute
+        assert response["results"]["temperature"][str(sensor_id)] == 3.0
+    assert query_client.app.state.query_cache.hits == 1
+
+
+def test_query_result_not_cached_across_concurrent_write(query_client, monkeypatch):
+    """A write landing while a query runs must keep that query's result out of the cache."""
+    sensor_id = query_client.post("/sensors/", json={"name": "racing-cache-sensor"}).json()["id"]
+    query_client.post("/metrics/", json={"sensor_id": sensor_id, "metric_type": "temperature", "value": 10.0})
+    cache = query_client.app.state.query_cache
+    original_aggregate = metrics_api.aggregate_metrics
+
+    async def aggregate_then_invalidate(db, **kwargs):
+        results = await original_aggregate(db, **kwargs)
+        cache.clear()  # What a metric write committing during the query does
+        return results
+
+    url = f"/metrics/query?stat=sum&sensors={sensor_id}&metrics=temperature"
+    monkeypatch.setattr(metrics_api, "aggregate_metrics", aggregate_then_invalidate)
+    assert query_client.get(url).status_code == 200
+    monkeypatch.undo()
+
+    assert query_client.get(url).status_code == 200
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_query_combines_rollups_with_newer_metrics(query_client, monkeypatch):
+    """Rolled-up hours plus metrics newer than the watermark should give exact stats."""
+    monkeypatch.setattr(query_client.app.state, "rollups_enabled", True)
+    sensor_id = query_client.post("/sensors/", json={"name": "rollup-sensor"}).json()["id"]
+    now = datetime.now(timezone.utc)
+    query_client.post("/metrics/bulk", json=[
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": value,
+         "timestamp": (now - timedelta(hours=hours)).isoformat()}
+        for hours, value in ((20, 10.0), (19, 20.0), (18, 30.0))
+    ])
+    
+    async def refresh_and_count():
+        async with query_client.app.state.session_factory() as db:
+            # The first pass only records the current max id; the second folds it
+            await refresh_rollups(db, await refresh_rollups(db, None))
+            return (await db.execute(select(func.count()).select_from(MetricRollupHourly))).scalar()
+    
+    assert query_client.portal.call(refresh_and_count) == 3
+    
+    # Late reading for an hour that is already rolled up
+    query_client.post("/metrics/", json={
+        "sensor_id": sensor_id, "metric_type": "temperature", "value": 40.0,
+        "timestamp": (now - timedelta(hours=19)).isoformat(),
+    })
+    
+    base = f"/metrics/query?sensors={sensor_id}&metrics=temperature"
+    expected = {"sum": 100.0, "avg": 25.0, "min": 10.0, "max": 40.0, "count": 4}
+    for stat, value in expected.items():
+        result = query_client.get(f"{base}&stat={stat}").json()["results"]["temperature"]
+        assert result[str(sensor_id)] == value, f"Stat '{stat}' mismatch"
+
+
+def test_query_with_offset_bounds_uses_utc_rollup_hours(query_client, monkeypatch):
+    """Bounds sent with a half-hour UTC offset must not drop rolled-up readings at the edges."""
+    monkeypatch.setattr(query_client.app.state, "rollups_enabled", True)
+    sensor_id = query_client.post("/sensors/", json={"name": "offset-sensor"}).json()["id"]
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=10)
+    query_client.post("/metrics/", json={
+        "sensor_id": sensor_id, "metric_type": "temperature", "value": 7.0,
+        "timestamp": (hour - timedelta(minutes=20)).isoformat(),
+    })
+
+    async def refresh():
+        async with query_client.app.state.session_factory() as db:
+            await refresh_rollups(db, await refresh_rollups(db, None))
+
+    query_client.portal.call(refresh)
+    # 45 minutes before the reading's next UTC hour, i.e. hh:15 in +05:30
+    start = (hour - timedelta(minutes=45)).astimezone(timezone(timedelta(hours=5, minutes=30)))
+    response = query_client.get("/metrics/query", params={
+        "stat": "sum", "sensors": sensor_id, "metrics": "temperature",
+        "start": start.isoformat(), "end": (start + timedelta(days=2)).isoformat(),
+    })
+    assert response.json()["results"]["temperature"][str(sensor_id)] == 7.0
+
+
+def test_fold_rebuilds_only_touched_hours(test_client):
+    """A backfilled reading should fold into its own hour without touching the hours in between."""
+    sensor_id = test_client.post("/sensors/", json={"name": "backfill-sensor"}).json()["id"]
+    recent = datetime.now(timezone.utc).replace(minute=30, second=0, microsecond=0) - timedelta(hours=2)
+    backfilled = recent - timedelta(days=365)
+    test_client.post("/metrics/bulk", json=[
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": value,
+         "timestamp": timestamp.isoformat()}
+        for timestamp, value in ((recent, 10.0), (recent, 20.0), (backfilled, 5.0))
+    ])
+
+    async def refresh_and_read():
+        async with test_client.app.state.session_factory() as db:
+            await refresh_rollups(db, await refresh_rollups(db, None))
+            rows = await db.execute(
+                select(MetricRollupHourly.value_sum, MetricRollupHourly.value_count)
+                .order_by(MetricRollupHourly.bucket)
+            )
+            return [tuple(row) for row in rows]
+
+    assert test_client.portal.call(refresh_and_read) == [(5.0, 1), (30.0, 2)]
+
+
+def test_query_exact_after_late_reading_is_folded(query_client, monkeypatch):
+    """Metrics folded into rebuilt buckets must not also be counted as raw rows."""
+    monkeypatch.setattr(query_client.app.state, "rollups_enabled", True)
+    sensor_id = query_client.post("/sensors/", json={"name": "late-fold-sensor"}).json()["id"]
+    earlier = (datetime.now(timezone.utc) - timedelta(hours=5)).isoformat()
+    reading = {"sensor_id": sensor_id, "metric_type": "temperature", "timestamp": earlier}
+    query_client.post("/metrics/", json={**reading, "value": 10.0})
+
+    session_factory = query_client.app.state.session_factory
+
+    async def refresh():
+        async with session_factory() as db:
+            await refresh_rollups(db, await refresh_rollups(db, None))
+
+    query_client.portal.call(refresh)
+    # Late reading for the rolled-up hour, folded just before the query runs
+    late_id = query_client.post("/metrics/", json={**reading, "value": 5.0}).json()["id"]
+    original_aggregate = metrics_api.aggregate_metrics
+
+    async def fold_then_aggregate(db, **kwargs):
+        async with session_factory() as other:
+            await fold_metrics(other, late_id)
+        return await original_aggregate(db, **kwargs)
+
+    monkeypatch.setattr(metrics_api, "aggregate_metrics", fold_then_aggregate)
+    response = query_client.get(f"/metrics/query?stat=sum&sensors={sensor_id}&metrics=temperature")
+    assert response.json()["results"]["temperature"][str(sensor_id)] == 15.0
+
+
+def test_query_runs_one_statement_without_rollups(query_client, test_engine):
+    """With the rollup task off, a default query should be a single SELECT."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(test_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = query_client.get("/metrics/query?stat=avg")
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert len(statements) == 1
+    assert "metric_rollup" not in statements[0]
 
 
 # ================================
 # Date Range Validation Tests
 # ================================
 
-def test_query_date_range_too_short_fails(test_client):
+def test_query_date_range_too_short_fails(query_client):
     """Date range less than 1 day should return 400."""
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-01T00:00:00Z&end=2024-01-01T12:00:00Z"
     )
     
@@ -382,9 +597,9 @@ def test_query_date_range_too_short_fails(test_client):
     assert "Date range must be at least 1 day" in response.json()["detail"]
 
 
-def test_query_date_range_too_long_fails(test_client):
+def test_query_date_range_too_long_fails(query_client):
     """Date range longer than 31 days should return 400."""
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-01T00:00:00Z&end=2024-02-15T00:00:00Z"
     )
     
@@ -392,9 +607,9 @@ def test_query_date_range_too_long_fails(test_client):
     assert "Date range cannot exceed 31 days" in response.json()["detail"]
 
 
-def test_query_end_before_start_fails(test_client):
+def test_query_end_before_start_fails(query_client):
     """End date before start date should return 400."""
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-15T00:00:00Z&end=2024-01-10T00:00:00Z"
     )
     
@@ -402,97 +617,154 @@ def test_query_end_before_start_fails(test_client):
     assert "End date must be after start date" in response.json()["detail"]
 
 
-def test_query_valid_date_ranges_succeed(test_client):
+def test_query_valid_date_ranges_succeed(query_client):
     """Valid date ranges (1-31 days) should be accepted."""
     # Test 1 day exactly
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-01T00:00:00Z&end=2024-01-02T00:00:00Z"
     )
     assert response.status_code == 200
     
     # Test 31 days exactly
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-01T00:00:00Z&end=2024-02-01T00:00:00Z"
     )
     assert response.status_code == 200
     
     # Test 7 days (typical use case)
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=2024-01-01T00:00:00Z&end=2024-01-08T00:00:00Z"
     )
     assert response.status_code == 200
 
 
-def test_query_single_date_parameters_work(test_client):
+def test_query_single_date_parameters_work(query_client):
     """Providing only start OR end date should work within 31-day window."""
     from datetime import datetime, timezone, timedelta
     
     # Only start date - use recent date within 31 days (format: YYYY-MM-DDTHH:MM:SSZ)
     recent_start = (datetime.now(timezone.utc) - timedelta(days=15)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    response = test_client.get(f"/metrics/query?stat=avg&start={recent_start}")
+    response = query_client.get(f"/metrics/query?stat=avg&start={recent_start}")
     assert response.status_code == 200
     
     # Only end date - use recent date within 31 days
     recent_end = (datetime.now(timezone.utc) + timedelta(days=15)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    response = test_client.get(f"/metrics/query?stat=avg&end={recent_end}")
+    response = query_client.get(f"/metrics/query?stat=avg&end={recent_end}")
     assert response.status_code == 200
 
 
-def test_query_single_date_outside_window_fails(test_client):
+def test_query_single_date_outside_window_fails(query_client):
     """Single date parameters outside 31-day window should fail."""
     # Start date too far in the past
-    response = test_client.get("/metrics/query?stat=avg&start=2020-01-01T00:00:00Z")
+    response = query_client.get("/metrics/query?stat=avg&start=2020-01-01T00:00:00Z")
     assert response.status_code == 400
     assert "more than 31 days in the past" in response.json()["detail"]
     
     # End date too far in the future
-    response = test_client.get("/metrics/query?stat=avg&end=2030-01-01T00:00:00Z")
+    response = query_client.get("/metrics/query?stat=avg&end=2030-01-01T00:00:00Z")
     assert response.status_code == 400
     assert "more than 31 days in the future" in response.json()["detail"]
 
 
-def test_query_malformed_datetime_fails(test_client):
+def test_query_malformed_datetime_fails(query_client):
     """Malformed datetime input should return 422."""
-    response = test_client.get(
+    response = query_client.get(
         "/metrics/query?stat=avg&start=not-a-date&end=2024-01-08T00:00:00Z"
     )
     assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "start"]
+
 
+def test_query_accepts_unix_timestamps(query_client):
+    """Unix timestamps should be accepted for start/end like ISO datetimes."""
+    response = query_client.get("/metrics/query?stat=avg&start=1704067200&end=1704153600")
+    assert response.status_code == 200
+    assert response.json()["start"].startswith("2024-01-01T00:00:00")
+    
+    # A lone epoch start far in the past reaches range validation
+    response = query_client.get("/metrics/query?stat=avg&start=1704067200")
+    assert response.status_code == 400
+
+
+def test_query_invalid_sensor_list_fails(query_client):
+    """Non-integer sensor IDs should return 400; blanks and spaces are tolerated."""
+    response = query_client.get("/metrics/query?stat=avg&sensors=1,abc")
+    assert response.status_code == 400
+    assert "Invalid sensor list format" in response.json()["detail"]
+    
+    response = query_client.get("/metrics/query?stat=avg&sensors=1,%202,,")
+    assert response.status_code == 200
+    assert response.json()["sensors"] == [1, 2]
 
-def test_query_invalid_stat_parameter_fails(test_client):
+
+def test_query_invalid_stat_parameter_fails(query_client):
     """Invalid stat parameter should return 422."""
-    response = test_client.get("/metrics/query?stat=median")  # Not supported
+    response = query_client.get("/metrics/query?stat=median")  # Not supported
     assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert (error["type"], error["loc"], error["input"]) == ("enum", ["query", "stat"], "median")
 
 
-def test_query_missing_stat_parameter_fails(test_client):
+def test_query_missing_stat_parameter_fails(query_client):
     """Missing required stat parameter should return 422."""
-    response = test_client.get("/metrics/query")  # No stat parameter
+    response = query_client.get("/metrics/query")  # No stat parameter
     assert response.status_code == 422
+    assert response.json()["detail"] == [
+        {"type": "missing", "loc": ["query", "stat"], "msg": "Field required", "input": None}
+    ]
+
+
+def test_query_invalid_metric_parameter_fails(query_client):
+    """Unknown metric types should return 422."""
+    response = query_client.get("/metrics/query?stat=avg&metrics=temperature&metrics=pressure")
+    assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert (error["type"], error["loc"]) == ("enum", ["query", "metrics", 1])
+
+
+def test_query_percent_encoded_keys_are_decoded(query_client):
+    """Escaped parameter names should match like their plain spelling."""
+    response = query_client.get("/metrics/query?st%61t=avg&metr%69cs=temperature")
+    assert response.status_code == 200
+    assert response.json()["metrics"] == ["temperature"]
+
+
+def test_query_string_parser_reads_known_params():
+    """The raw query parser should decode escapes, repeat metrics and skip unknown keys."""
+    params = _parse_known_query(
+        b"stat=avg&sensors=1%2C2&metrics=temperature&metrics=humidity&debug=1"
+        b"&start=2024-01-01T00:00:00%2B00:00"
+    )
+    assert params == {
+        "stat": "avg",
+        "sensors": "1,2",
+        "metrics": ["temperature", "humidity"],
+        "start": "2024-01-01T00:00:00+00:00",
+        "end": None,
+    }
 
 
 # ================================
 # Integration Tests
 # ================================
 
-def test_complete_workflow_temperature_sensor(test_client):
+def test_complete_workflow_temperature_sensor(query_client):
     """Complete workflow: create sensor, add metrics, query aggregations."""
     # Create sensor
-    sensor_response = test_client.post("/sensors/", json={"name": "integration-temp-sensor"})
+    sensor_response = query_client.post("/sensors/", json={"name": "integration-temp-sensor"})
     sensor_id = sensor_response.json()["id"]
     
-    # Add temperature readings
+    # Add temperature readings in one batch
     temperatures = [20.0, 22.5, 25.0, 21.5, 23.0]
-    for temp in temperatures:
-        response = test_client.post("/metrics/", json={
-            "sensor_id": sensor_id,
-            "metric_type": "temperature", 
-            "value": temp
-        })
-        assert response.status_code == 201
+    response = query_client.post("/metrics/bulk", json=[
+        {"sensor_id": sensor_id, "metric_type": "temperature", "value": temp}
+        for temp in temperatures
+    ])
+    assert response.status_code == 201
+    assert response.json()["inserted"] == len(temperatures)
     
     # Query average
-    response = test_client.get(f"/metrics/query?stat=avg&sensors={sensor_id}&metrics=temperature")
+    response = query_client.get(f"/metrics/query?stat=avg&sensors={sensor_id}&metrics=temperature")
     assert response.status_code == 200
     
     # Verify result structure
@@ -504,22 +776,22 @@ def test_complete_workflow_temperature_sensor(test_client):
     assert str(sensor_id) in data["results"]["temperature"]  # API returns sensor IDs as strings
 
 
-def test_multi_sensor_multi_metric_query(test_client):
+def test_multi_sensor_multi_metric_query(query_client):
     """Test querying multiple sensors and metric types."""
     # Create two sensors
-    sensor1_response = test_client.post("/sensors/", json={"name": "outdoor-station"})
-    sensor2_response = test_client.post("/sensors/", json={"name": "indoor-station"})
+    sensor1_response = query_client.post("/sensors/", json={"name": "outdoor-station"})
+    sensor2_response = query_client.post("/sensors/", json={"name": "indoor-station"})
     sensor1_id = sensor1_response.json()["id"]
     sensor2_id = sensor2_response.json()["id"]
     
     # Add metrics to both sensors
-    test_client.post("/metrics/", json={"sensor_id": sensor1_id, "metric_type": "temperature", "value": 15.0})
-    test_client.post("/metrics/", json={"sensor_id": sensor1_id, "metric_type": "humidity", "value": 80.0})
-    test_client.post("/metrics/", json={"sensor_id": sensor2_id, "metric_type": "temperature", "value": 22.0})
-    test_client.post("/metrics/", json={"sensor_id": sensor2_id, "metric_type": "humidity", "value": 45.0})
+    query_client.post("/metrics/", json={"sensor_id": sensor1_id, "metric_type": "temperature", "value": 15.0})
+    query_client.post("/metrics/", json={"sensor_id": sensor1_id, "metric_type": "humidity", "value": 80.0})
+    query_client.post("/metrics/", json={"sensor_id": sensor2_id, "metric_type": "temperature", "value": 22.0})
+    query_client.post("/metrics/", json={"sensor_id": sensor2_id, "metric_type": "humidity", "value": 45.0})
     
     # Query both sensors, both metrics
-    response = test_client.get(
+    response = query_client.get(
         f"/metrics/query?stat=avg&sensors={sensor1_id},{sensor2_id}&metrics=temperature&metrics=humidity"
     )
     
@@ -528,4 +800,63 @@ def test_multi_sensor_multi_metric_query(test_client):
     assert "temperature" in data["results"]
     assert "humidity" in data["results"]
     assert str(sensor1_id) in data["results"]["temperature"]  # API returns sensor IDs as strings
-    assert str(sensor2_id) in data["results"]["temperature"]
\ No newline at end of file
+    assert str(sensor2_id) in data["results"]["temperature"]
+
+
+def test_large_query_response_is_gzipped(query_client):
+    """Responses above the size threshold should be gzip-encoded when accepted."""
+    sensors = ",".join(str(i) for i in range(1, 201))
+    url = f"/metrics/query?stat=avg&sensors={sensors}&metrics=temperature&metrics=humidity"
+    
+    response = query_client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["sensors"]) == 200
+    
+    assert "content-encoding" not in query_client.get("/healthz", headers={"Accept-Encoding": "gzip"}).headers
+
+
+def test_query_requested_sensor_without_data_is_null(query_client):
+    """Requested sensors with no readings in the window should map to null (0 for count)."""
+    sensor1_id = query_client.post("/sensors/", json={"name": "reporting-station"}).json()["id"]
+    sensor2_id = query_client.post("/sensors/", json={"name": "silent-station"}).json()["id"]
+    query_client.post("/metrics/", json={"sensor_id": sensor1_id, "metric_type": "temperature", "value": 18.0})
+
+    response = query_client.get(
+        f"/metrics/query?stat=max&sensors={sensor1_id},{sensor2_id}&metrics=temperature&metrics=humidity"
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results["temperature"] == {str(sensor1_id): 18.0, str(sensor2_id): None}
+    assert results["humidity"] == {str(sensor1_id): None, str(sensor2_id): None}
+    
+    # A count over no readings is 0, not null
+    response = query_client.get(
+        f"/metrics/query?stat=count&sensors={sensor1_id},{sensor2_id}&metrics=temperature&metrics=humidity"
+    )
+    results = response.json()["results"]
+    assert results["temperature"] == {str(sensor1_id): 1, str(sensor2_id): 0}
+    assert results["humidity"] == {str(sensor1_id): 0, str(sensor2_id): 0}
+
+
+# ================================
+# Logging Tests
+# ================================
+
+def test_log_records_outside_orjson_types_are_serialized():
+    """Records with ints wider than 64 bits or int dict keys must still be written."""
+    lines = []
+    handler_id = logger.add(
+        lambda message: lines.append(_serialize_record(message, message.record)), format="{message}"
+    )
+    try:
+        logger.error("Query failed: {}", "overflow", extra={"sensors": [99999999999999999999999]})
+        logger.info("Grouped", extra={"by_sensor": {1: 2.5}})
+    finally:
+        logger.remove(handler_id)
+    
+    records = [json.loads(line)["record"] for line in lines]
+    assert records[0]["message"] == "Query failed: overflow"
+    assert records[0]["extra"]["extra"]["sensors"] == [99999999999999999999999]
+    assert records[1]["extra"]["extra"]["by_sensor"] == {"1": 2.5}